@@ -2,5 +2,6 @@ from .slides import Slides
 from .sheets import Sheets
 from .docs import Document
 from .config import init
+from .batching import async_batch, batch
 
-__all__ = ["Slides", "Sheets", "Document", "init"]
+__all__ = ["Slides", "Sheets", "Document", "init", "batch", "async_batch"]
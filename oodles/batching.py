@@ -0,0 +1,216 @@
+import asyncio
+import contextvars
+from contextlib import asynccontextmanager, contextmanager
+
+from .config import config
+from .utils import execute_batch, get_executor
+
+# per-context queue, so concurrent asyncio tasks do not share a batch
+_queue = contextvars.ContextVar("oodles_batch_queue", default=None)
+# text each shape will hold once the queue is flushed, by (doc_id, obj_id)
+_texts = contextvars.ContextVar("oodles_batch_texts", default=None)
+
+
+def pending_text(doc_id: str, obj_id: str, default: str) -> str:
+    """Text a shape will hold after the current batch, if it edits it."""
+    texts = _texts.get()
+    if texts is None:
+        return default
+    return texts.get((doc_id, obj_id), default)
+
+
+def set_pending_text(doc_id: str, obj_id: str, text: str):
+    """Record the text queued for a shape in the current batch, if any."""
+    texts = _texts.get()
+    if texts is not None:
+        texts[(doc_id, obj_id)] = text
+
+
+# text requests made redundant by a later deleteText on the same shape
+_TEXT_OPS = ("deleteText", "insertText", "updateTextStyle")
+
+
+def compact(requests: list) -> list:
+    """Drop text edits that a later full deleteText of the shape undoes."""
+    kept = []
+    cleared = set()
+    for request in reversed(requests):
+        op = next(iter(request))
+        if op in _TEXT_OPS:
+            obj_id = request[op].get("objectId")
+            if obj_id in cleared:
+                continue
+            if op == "deleteText" and "textRange" not in request[op]:
+                cleared.add(obj_id)
+        kept.append(request)
+    kept.reverse()
+    return kept
+
+
+class _Deferred:
+    """Placeholder for requests built from a background task's result."""
+
+    def __init__(self, future, then):
+        self.future = future
+        self.then = then
+
+    def resolve(self) -> list:
+        return self.then(self.future.result())
+
+
+class _OnSent:
+    """Callback queued with requests, run once the flush has succeeded."""
+
+    def __init__(self, fn):
+        self.fn = fn
+
+
+def _resolve(items: list) -> list:
+    requests = []
+    for item in items:
+        if isinstance(item, _Deferred):
+            requests.extend(item.resolve())
+        elif not isinstance(item, _OnSent):
+            requests.append(item)
+    return requests
+
+
+# maximum number of requests sent in a single batchUpdate
+MAX_BATCH_REQUESTS = 500
+
+
+def _object_id(request: dict):
+    body = next(iter(request.values()))
+    return body.get("objectId") or body.get("imageObjectId")
+
+
+def split(requests: list, size: int = MAX_BATCH_REQUESTS) -> list:
+    """Split requests into chunks of at most size requests, keeping
+    consecutive requests on the same object (e.g. delete/insert/style)
+    together unless there are more than size of them."""
+    units = []
+    previous = None
+    for request in requests:
+        obj_id = _object_id(request)
+        if (units and obj_id is not None and obj_id == previous
+                and len(units[-1]) < size):
+            units[-1].append(request)
+        else:
+            units.append([request])
+        previous = obj_id
+
+    chunks = []
+    chunk = []
+    for unit in units:
+        if chunk and len(chunk) + len(unit) > size:
+            chunks.append(chunk)
+            chunk = []
+        chunk.extend(unit)
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def flush_pending(requests_by_doc_id: dict):
+    """Send the queued batchUpdate payloads as multipart HTTP batches.
+
+    Presentations whose updates exceed MAX_BATCH_REQUESTS are sent over
+    several rounds, in order; a failing round stops the flush. The on_sent
+    callbacks given to submit() only run when every round went through.
+    """
+    chunks_by_doc_id = {
+        doc_id: split(compact(_resolve(items)))
+        for doc_id, items in requests_by_doc_id.items()
+    }
+    rounds = max(map(len, chunks_by_doc_id.values()), default=0)
+    for i in range(rounds):
+        execute_batch(config.SLIDES, [
+            config.SLIDES.presentations().batchUpdate(
+                body={"requests": chunks[i]},
+                presentationId=doc_id)
+            for doc_id, chunks in chunks_by_doc_id.items()
+            if i < len(chunks)
+        ])
+    for items in requests_by_doc_id.values():
+        for item in items:
+            if isinstance(item, _OnSent):
+                item.fn()
+
+
+@contextmanager
+def batch():
+    """Queue slide updates and send them all in one HTTP exchange on exit.
+
+    Updates to the same presentation, whether they come from text blocks,
+    images or charts, are merged into a single batchUpdate.
+    """
+    if _queue.get() is not None:
+        # nested batches are merged into the outermost one
+        yield
+        return
+    queue = {}
+    token = _queue.set(queue)
+    # dropped with the queue if the body or the flush fails
+    texts_token = _texts.set({})
+    try:
+        yield
+    finally:
+        _texts.reset(texts_token)
+        _queue.reset(token)
+    flush_pending(queue)
+
+
+@asynccontextmanager
+async def async_batch():
+    """Asynchronous batch(): the flush runs off the event loop thread."""
+    if _queue.get() is not None:
+        yield
+        return
+    queue = {}
+    token = _queue.set(queue)
+    # dropped with the queue if the body or the flush fails
+    texts_token = _texts.set({})
+    try:
+        yield
+    finally:
+        _texts.reset(texts_token)
+        _queue.reset(token)
+    loop = asyncio.get_running_loop()
+    # not the shared pool: the flush itself waits on tasks queued there
+    await loop.run_in_executor(None, flush_pending, queue)
+
+
+def submit(doc_id: str, requests: list, on_sent=None):
+    """Run a presentation batchUpdate now, or queue it inside batch().
+
+    on_sent is called once the requests have been sent successfully, i.e.
+    at flush time inside batch(); it is dropped if they never are.
+    """
+    if not requests:
+        return
+    queue = _queue.get()
+    if queue is not None:
+        items = queue.setdefault(doc_id, [])
+        items.extend(requests)
+        if on_sent is not None:
+            items.append(_OnSent(on_sent))
+        return
+    config.SLIDES.presentations().batchUpdate(
+        body={"requests": requests},
+        presentationId=doc_id).execute()
+    if on_sent is not None:
+        on_sent()
+
+
+def submit_deferred(doc_id: str, fn, arg, then):
+    """Submit then(fn(arg)); inside batch(), fn runs on a worker thread.
+
+    The requests keep their place in the queue and are built at flush time,
+    once the background call has returned.
+    """
+    queue = _queue.get()
+    if queue is None:
+        submit(doc_id, then(fn(arg)))
+        return
+    future = get_executor().submit(fn, arg)
+    queue.setdefault(doc_id, []).append(_Deferred(future, then))
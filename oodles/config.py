@@ -1,8 +1,22 @@
+from functools import cached_property
+
 from googleapiclient.discovery import build, Resource
+from googleapiclient.http import HttpRequest, build_http
+from googleapiclient.model import JsonModel
+from google.auth.transport.requests import AuthorizedSession
 from google.oauth2 import service_account
 from google.cloud import storage
+from google_auth_httplib2 import AuthorizedHttp
 import json
 import os
+import requests
+from requests.adapters import HTTPAdapter
+import threading
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # environment variables
 scopes = (
@@ -12,9 +26,65 @@ scopes = (
     "https://www.googleapis.com/auth/documents",
 )
 
+# clients built lazily on first access
+_clients = (
+    "DRIVE", "SLIDES", "SHEETS", "DOCS", "STORAGE_CLIENT", "BUCKET_HANDLE",
+    "AUTHED_SESSION", "HTTP_SESSION",
+)
+
+# keep-alive connections kept per host by the requests sessions
+SESSION_POOL_SIZE = 20
+
+# retries on 429/5xx with the client's exponential backoff
+NUM_RETRIES = 5
+
+
+class RetryHttpRequest(HttpRequest):
+    """HttpRequest retrying transient errors unless told otherwise."""
+
+    def execute(self, http=None, num_retries=None):
+        if num_retries is None:
+            num_retries = NUM_RETRIES
+        return super().execute(http=http, num_retries=num_retries)
+
+
+class OrjsonModel(JsonModel):
+    """JsonModel encoding request bodies with orjson when it is installed."""
+
+    def serialize(self, body_value):
+        if orjson is None:
+            return super().serialize(body_value)
+        if (isinstance(body_value, dict) and "data" not in body_value
+                and self._data_wrapper):
+            body_value = {"data": body_value}
+        try:
+            return orjson.dumps(body_value).decode()
+        except TypeError:
+            # e.g. non-string keys, which the stdlib encoder accepts
+            return super().serialize(body_value)
+
+
+def _mount_pool(session: requests.Session):
+    adapter = HTTPAdapter(pool_connections=10, pool_maxsize=SESSION_POOL_SIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+
+def _build(service: str, version: str, http) -> Resource:
+    # discovery documents bundled with the client: no network at all
+    return build(
+        service,
+        version,
+        http=http,
+        static_discovery=True,
+        requestBuilder=RetryHttpRequest,
+        model=OrjsonModel(),
+    )
+
 
 class Config:
     def __init__(self, credentials_path: str = None):
+        self._local = threading.local()
         if "GOOGLE_DOC_CREDENTIALS" not in os.environ:
             return
 
@@ -23,20 +93,91 @@ class Config:
         if not os.path.exists(credentials_path):
             return
 
-        credentials = service_account.Credentials.from_service_account_file(
-            credentials_path, scopes=scopes
+        self.load(credentials_path)
+
+    def load(self, credentials_path: str):
+        with open(credentials_path, "r") as f:
+            info = json.load(f)
+
+        credentials = service_account.Credentials.from_service_account_info(
+            info, scopes=scopes
         )
-        self.DRIVE = build("drive", "v3", credentials=credentials)
-        self.SLIDES = build("slides", "v1", credentials=credentials)
-        self.SHEETS = build("sheets", "v4", credentials=credentials)
-        self.DOCS = build("docs", "v1", credentials=credentials)
+        self._info = info
+        self._credentials = credentials
+        # main-thread transport for batches; each client has its own
+        self._http = self._new_http()
         self.BUCKET = os.environ.get("OODLES_BUCKET", "gs://data-studies/img")
-        self.STORAGE_CLIENT = storage.Client.from_service_account_json(credentials_path)
+        self.service_email = info["client_email"]
 
-        with open(credentials_path, "r") as f:
-            service_email = json.load(f)["client_email"]
+        # forget clients built with previous credentials
+        for name in _clients:
+            self.__dict__.pop(name, None)
 
-        self.service_email = service_email
+    def _new_http(self) -> AuthorizedHttp:
+        """A keep-alive authorized transport; httplib2 is not thread-safe,
+        so transports are never shared between clients or threads."""
+        return AuthorizedHttp(self._credentials, http=build_http())
+
+    def thread_http(self) -> AuthorizedHttp:
+        """Return the calling thread's own keep-alive authorized transport."""
+        if threading.current_thread() is threading.main_thread():
+            return self._http
+        http = getattr(self._local, "http", None)
+        if http is None or http.credentials is not self._credentials:
+            http = self._new_http()
+            self._local.http = http
+        return http
+
+    @property
+    def BUCKET(self) -> str:
+        return self._bucket
+
+    @BUCKET.setter
+    def BUCKET(self, value: str):
+        # parse "gs://<name>/<prefix>" once instead of on every upload
+        path = value.removeprefix("gs://").split("/")
+        self._bucket = value
+        self.BUCKET_NAME = path[0]
+        self.BUCKET_PREFIX = "/".join(path[1:])
+        self.__dict__.pop("BUCKET_HANDLE", None)
+
+    @cached_property
+    def BUCKET_HANDLE(self):
+        return self.STORAGE_CLIENT.bucket(self.BUCKET_NAME)
+
+    @cached_property
+    def DRIVE(self) -> Resource:
+        return _build("drive", "v3", self._new_http())
+
+    @cached_property
+    def SLIDES(self) -> Resource:
+        return _build("slides", "v1", self._new_http())
+
+    @cached_property
+    def SHEETS(self) -> Resource:
+        return _build("sheets", "v4", self._new_http())
+
+    @cached_property
+    def DOCS(self) -> Resource:
+        return _build("docs", "v1", self._new_http())
+
+    @cached_property
+    def STORAGE_CLIENT(self):
+        return storage.Client.from_service_account_info(self._info)
+
+    @cached_property
+    def AUTHED_SESSION(self) -> AuthorizedSession:
+        """Authorized requests session for calls outside the API clients."""
+        session = AuthorizedSession(self.SLIDES._http.credentials)
+        _mount_pool(session)
+        return session
+
+    @cached_property
+    def HTTP_SESSION(self) -> requests.Session:
+        """Plain requests session, e.g. for downloading thumbnails."""
+        session = requests.Session()
+        _mount_pool(session)
+        return session
 
     def init(
         self,
@@ -52,8 +193,8 @@ class Config:
         self.SLIDES = SLIDES
         self.SHEETS = SHEETS
         self.DOCS = DOCS
-        self.BUCKET = BUCKET
         self.STORAGE_CLIENT = STORAGE_CLIENT
+        self.BUCKET = BUCKET
         self.service_email = service_email
 
 
@@ -61,17 +202,4 @@ config = Config()
 
 
 def init(credentials_path: str):
-    credentials = service_account.Credentials.from_service_account_file(
-        credentials_path, scopes=scopes
-    )
-    DRIVE = build("drive", "v3", credentials=credentials)
-    SLIDES = build("slides", "v1", credentials=credentials)
-    SHEETS = build("sheets", "v4", credentials=credentials)
-    DOCS = build("docs", "v1", credentials=credentials)
-    BUCKET = os.environ.get("OODLES_BUCKET", "gs://data-studies/img")
-    STORAGE_CLIENT = storage.Client.from_service_account_json(credentials_path)
-
-    with open(credentials_path, "r") as f:
-        service_email = json.load(f)["client_email"]
-
-    config.init(DRIVE, SLIDES, SHEETS, DOCS, BUCKET, STORAGE_CLIENT, service_email)
+    config.load(credentials_path)
@@ -1,9 +1,21 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import re
+from typing import Union
+
 from googleapiclient.errors import HttpError
 
 from .config import config
-from .utils import GoogleAuthorizationError
+from .utils import GoogleAuthorizationError, chunks, share_file
+
+_BOLD_RE = re.compile(r"<b>(.*?)</b>", re.DOTALL)
+
+# parts of the document read by load() unless a full fetch is asked for
+LOAD_FIELDS = "title,body(content(endIndex))"
+
+# maximum number of requests sent in a single batchUpdate
+SET_CONTENT_CHUNK_SIZE = 500
+
 
 class Document:
     def __init__(self, doc_id: str):
@@ -21,22 +33,18 @@ class Document:
             body=body, fields="id").execute()
         return Document(document.get("id"))
 
-    def share_with(self, email: str):
-        user_permission = {
-            "type": "user",
-            "role": "writer",
-            "emailAddress": email
-        }
-        config.DRIVE.permissions().create(
-            fileId=self.doc_id,
-            body=user_permission,
-            fields="id").execute()
+    def share_with(self,
+                   email: Union[str, list[str]],
+                   as_admin: bool = False,
+                   send_notification_email: bool = True):
+        share_file(self.doc_id, email, as_admin, send_notification_email)
 
-    def load(self):
+    def load(self, full: bool = False):
+        """Fetch the document; only the title and end index unless full."""
+        fields = None if full else LOAD_FIELDS
         try:
-            result = config.DOCS.documents().get(
-                documentId=self.doc_id).execute()
-            self.document = result
+            self.document = config.DOCS.documents().get(
+                documentId=self.doc_id, fields=fields).execute()
         except HttpError as e:
             raise GoogleAuthorizationError(e, config.service_email)
         self.title = self.document["title"]
@@ -47,23 +55,32 @@ class Document:
             self.load()
 
             # Empty the document and execute the request
-            end_index = self.document['body']['content'][-1]['endIndex'] - 1
-            requests = [{
-                'deleteContentRange': {
-                    'range': {
-                        'startIndex': 1,
-                        'endIndex': end_index,
-                    }
-                }
-            }]
-            config.DOCS.documents().batchUpdate(
-                documentId=self.doc_id, body={'requests': requests}).execute()
-
-            # Fetch the document again to get the latest endIndex
-            self.load()
+            requests = self._empty_requests()
+            if requests:
+                config.DOCS.documents().batchUpdate(
+                    documentId=self.doc_id, body={'requests': requests}).execute()
+                # An emptied body is the section break plus one empty
+                # paragraph: update the endIndex locally instead of reloading
+                body = self.document['body']
+                body['content'] = body['content'][:1] + [
+                    {'startIndex': 1, 'endIndex': 2}]
         except HttpError:
             pass
 
+    def _empty_requests(self) -> list:
+        """Requests deleting the whole body of the loaded document."""
+        end_index = self.document['body']['content'][-1]['endIndex'] - 1
+        if end_index <= 1:
+            return []
+        return [{
+            'deleteContentRange': {
+                'range': {
+                    'startIndex': 1,
+                    'endIndex': end_index,
+                }
+            }
+        }]
+
     def set_title(self, new_title: str):
         body = {"name": new_title}
         request = config.DRIVE.files().update(fileId=self.doc_id, body=body)
@@ -72,64 +89,76 @@ class Document:
 
     def set_content(self, text_list: list[str]):
         """Set the content of the document."""
-        # Empty the document
-        self.empty_document()
-
-        # Find the current end of the document
-        current_end = self.document['body']['content'][-1]['endIndex']
+        # Fetch the latest endIndex once and empty the document in the same
+        # batchUpdate as the insertions
+        self.load()
+        requests = self._empty_requests()
+        # Concatenate every line and record where the bold runs fall, so the
+        # whole body goes in with one insertText
+        parts = []
+        bold_ranges = []
         current_end = 1
-
-        # Start a list of requests
-        requests = []
-
-        # For each string in text_list
         for text in text_list:
-            # Check if text is to be bold
-            if '<b>' in text and '</b>' in text:
-                # Remove HTML tags from text
-                clean_text = text.replace('<b>', '').replace('</b>', '')
-                clean_text += '\n'
-
-                # Add an insert text request
-                requests.append({
-                    'insertText': {
-                        'location': {
-                            'index': current_end,
-                        },
-                        'text': clean_text
-                    }
-                })
-
-                # Add a bold request
-                requests.append({
-                    'updateTextStyle': {
-                        'range': {
-                            'startIndex': current_end,
-                            'endIndex': current_end + len(clean_text),
-                        },
-                        'textStyle': {
-                            'bold': True,
-                        },
-                        'fields': 'bold',
-                    }
-                })
-                # Update the current end of the document
-                current_end += len(clean_text)
-            else:
+            # Plain lines, the common case, skip the regex entirely
+            if '<b>' not in text:
                 text += '\n'
-                # Add an insert text request
-                requests.append({
-                    'insertText': {
-                        'location': {
-                            'index': current_end,
-                        },
-                        'text': text
-                    }
-                })
-                # Update the current end of the document
+                parts.append(text)
                 current_end += len(text)
-
-        # Send the batchUpdate request
-        result = config.DOCS.documents().batchUpdate(
-            documentId=self.doc_id, body={'requests': requests}).execute()
+                continue
+
+            # Strip <b>...</b> tags, keeping track of the bold spans
+            pos = 0
+            for match in _BOLD_RE.finditer(text):
+                plain = text[pos:match.start()]
+                bold = match.group(1)
+                parts.append(plain)
+                current_end += len(plain)
+                if bold:
+                    end = current_end + len(bold)
+                    # Merge with the previous run when contiguous
+                    if bold_ranges and bold_ranges[-1][1] == current_end:
+                        bold_ranges[-1][1] = end
+                    else:
+                        bold_ranges.append([current_end, end])
+                    parts.append(bold)
+                    current_end = end
+                pos = match.end()
+            tail = text[pos:] + '\n'
+            parts.append(tail)
+            current_end += len(tail)
+
+        if parts:
+            requests.append({
+                'insertText': {
+                    'location': {
+                        'index': 1,
+                    },
+                    'text': ''.join(parts)
+                }
+            })
+        for start, end in bold_ranges:
+            requests.append({
+                'updateTextStyle': {
+                    'range': {
+                        'startIndex': start,
+                        'endIndex': end,
+                    },
+                    'textStyle': {
+                        'bold': True,
+                    },
+                    'fields': 'bold',
+                }
+            })
+
+        # Send the requests in order, a bounded number per batchUpdate
+        result = None
+        for chunk in chunks(requests, SET_CONTENT_CHUNK_SIZE):
+            response = config.DOCS.documents().batchUpdate(
+                documentId=self.doc_id, body={'requests': chunk}).execute()
+            if result is None:
+                result = response
+            else:
+                result.setdefault('replies', []).extend(
+                    response.get('replies', []))
+                result['writeControl'] = response.get('writeControl')
         return result
@@ -1,5 +1,12 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
 from typing import Union
 
+from .batching import (
+    batch, pending_text, set_pending_text, submit as _submit, submit_deferred
+)
 from .config import config
 from datetime import datetime, timedelta
 
@@ -9,63 +16,127 @@ from datetime import datetime, timedelta
 # =============================================================================
 
 class TextBlocks(object):
+    __slots__ = ("doc_id", "_by_id")
+
     def __init__(self, doc_id: str):
         self.doc_id = doc_id
-        self.elements = []
-        self.obj_ids = set()
+        self._by_id = {}
+
+    @property
+    def elements(self) -> tuple:
+        # read-only: blocks are added with add() or +=
+        return tuple(self._by_id.values())
 
     def add(self, block: "TextBlock"):
-        self.elements.append(block)
-        self.obj_ids.add(block.obj_id)
+        # like +=, the first block added for a shape is kept
+        self._by_id.setdefault(block.obj_id, block)
 
     def __repr__(self):
-        return self.elements.__repr__()
+        return list(self._by_id.values()).__repr__()
 
     def __iadd__(self, block: Union["TextBlock", "TextBlocks"]):
         if isinstance(block, TextBlock):
             self.add(block)
         elif isinstance(block, TextBlocks):
-            for element in block.elements:
-                if element.obj_id in self.obj_ids:
-                    continue
-                self.elements.append(block)
-                self.obj_ids.add(element.obj_id)
+            for element in block._by_id.values():
+                self.add(element)
         return self
 
     def change_text(self, value: str):
         requests = []
-        for element in self.elements:
-            requests += element._fill(value)
-        config.SLIDES.presentations().batchUpdate(
-            body={"requests": requests},
-            presentationId=self.doc_id).execute()
-
-    def __setattr__(self, name: str, value: str):
-        if name == "text":
-            self.change_text(value)
-        else:
-            super(TextBlocks, self).__setattr__(name, value)
+        updates = []
+        for element in self._by_id.values():
+            fill = element._fill(value)
+            if fill:
+                requests += fill
+                updates.append((element, value))
+        _submit(self.doc_id, requests, on_sent=_text_setter(updates))
+
+    # write-only alias kept for `blocks.text = ...`
+    text = property(None, change_text)
 
     def __assign__(self, value: str):
         self.change_text(value)
 
     def replace(self, key: str, value: str):
         requests = []
-        for element in self.elements:
-            requests += element._replace(key, value)
-
-        config.SLIDES.presentations().batchUpdate(
-            body={"requests": requests},
-            presentationId=self.doc_id).execute()
+        updates = []
+        for element in self._by_id.values():
+            text = element.current_text().replace(key, value)
+            fill = element._replace(key, value)
+            if fill:
+                requests += fill
+                updates.append((element, text))
+        _submit(self.doc_id, requests, on_sent=_text_setter(updates))
+
+    def replace_all(self, key: str, value: str):
+        """Replace key by value server-side with a single replaceAllText.
+
+        Unlike replace(), the style of each run is kept, and every
+        occurrence on the pages of these blocks is replaced, not only the
+        ones inside the blocks themselves.
+        """
+        if not self._by_id:
+            return
+        page_ids = []
+        for element in self._by_id.values():
+            if element.page_id is None:
+                # unknown page: let the request span the whole presentation
+                page_ids = None
+                break
+            if element.page_id not in page_ids:
+                page_ids.append(element.page_id)
+        request = {
+            "containsText": {"text": key, "matchCase": True},
+            "replaceText": value
+        }
+        if page_ids:
+            request["pageObjectIds"] = page_ids
+        updates = []
+        for element in self._by_id.values():
+            text = element.current_text().replace(key, value)
+            set_pending_text(element.doc_id, element.obj_id, text)
+            updates.append((element, text))
+        _submit(self.doc_id, [{"replaceAllText": request}],
+                on_sent=_text_setter(updates))
+
+
+def _text_setter(updates: list):
+    """Callback updating the local texts once their requests were sent."""
+    def apply():
+        for block, text in updates:
+            block.text = text
+    return apply
 
 
 class TextBlock:
-    def __init__(self, obj_id: str, text: str, style: dict = None):
+    __slots__ = ("obj_id", "text", "style", "page_id", "doc_id",
+                 "_delete_req", "_style_req")
+
+    def __init__(self,
+                 obj_id: str,
+                 text: str,
+                 style: dict = None,
+                 page_id: str = None,
+                 doc_id: str = None):
         if style is None:
             style = {}
         self.obj_id = obj_id
         self.text = text
         self.style = style
+        self.page_id = page_id
+        self.doc_id = doc_id
+        # invariant parts of the update requests, built once per block
+        self._delete_req = {"deleteText": {"objectId": obj_id}}
+        self._style_req = None
+        if style:
+            self._style_req = {
+                "updateTextStyle": {
+                    "style": style,
+                    "objectId": obj_id,
+                    "fields": "*"
+                }
+            }
 
     def match(self, query: str) -> bool:
         return query in self.text
@@ -73,41 +144,40 @@ class TextBlock:
     def __repr__(self) -> str:
         return f"{self.text}"
 
+    def set_text(self, value: str):
+        """Replace the text of this block only; queued inside batch()."""
+        _submit(self.doc_id, self._fill(value),
+                on_sent=_text_setter([(self, value)]))
+
+    def current_text(self) -> str:
+        """Text of the block, including edits queued in the current batch."""
+        return pending_text(self.doc_id, self.obj_id, self.text)
+
     def _fill(self, value: str) -> list:
-        new_text = value
-        return [
-            {"deleteText": {"objectId": self.obj_id}},
+        if value == self.current_text():
+            return []
+        # self.text is only updated once the requests have been sent; until
+        # then later edits in the same batch build on the queued text
+        set_pending_text(self.doc_id, self.obj_id, value)
+        requests = [
+            self._delete_req,
             {
                 "insertText": {
-                    "text": new_text,
+                    "text": value,
                     "objectId": self.obj_id
                 }
-            },
-            {"updateTextStyle": {
-                "style": self.style,
-                "objectId": self.obj_id,
-                "fields": "*"
-            }}
+            }
         ]
+        # an empty style would only reset the block to its defaults
+        if self._style_req is not None:
+            requests.append(self._style_req)
+        return requests
 
     def _replace(self, key: str, value: str) -> list:
-        new_text = self.text.replace(key, value)
-        return [
-            {"deleteText": {"objectId": self.obj_id}},
-            {
-                "insertText": {
-                    "text": new_text,
-                    "objectId": self.obj_id
-                }
-            },
-            {
-                "updateTextStyle": {
-                    "style": self.style,
-                    "objectId": self.obj_id,
-                    "fields": "*"
-                }
-            }
-        ]
+        text = self.current_text()
+        if key not in text:
+            return []
+        return self._fill(text.replace(key, value))
 
 
 # =============================================================================
@@ -117,21 +187,94 @@ class TextBlock:
 class Images:
     def __init__(self):
         self.elements = []
+        self.by_id = {}
 
     def add(self, block: "Image"):
         self.elements.append(block)
+        self.by_id[block.obj_id] = block
+
+    def _get(self, key: Union[int, str]) -> "Image":
+        # images are addressed by position or by object id
+        if isinstance(key, str):
+            return self.by_id[key]
+        return self.elements[key]
+
+    def __setitem__(self, key: Union[int, str], value: str):
+        self._get(key).replace_image(value)
+
+    def upload_files(self, mapping: dict):
+        """Replace several images from local files in one batchUpdate.
 
-    def __setitem__(self, key: int, value: str):
-        self.elements[key].replace_image(value)
+        The files are uploaded concurrently on the shared worker pool.
+        """
+        with batch():
+            for key, path in mapping.items():
+                self._get(key).set_file(path)
 
     def __len__(self):
         return len(self.elements)
 
-    def __getitem__(self, item):
-        return self.elements[item]
+    def __getitem__(self, item: Union[int, str]) -> "Image":
+        return self._get(item)
+
+
+# resumable uploads send files in chunks of this size
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def _md5(path: str) -> str:
+    """Hex MD5 digest of a local file."""
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# signed URLs of recent uploads, keyed by the blob they point to
+_uploads = OrderedDict()
+_uploads_lock = threading.Lock()
+UPLOAD_CACHE_SIZE = 256
+# cached URLs closer than this to expiry are signed again
+UPLOAD_URL_MARGIN = timedelta(minutes=2)
+
+
+def _upload(path: str) -> str:
+    """Upload a local file to config.BUCKET and return a signed URL."""
+    filename = os.path.basename(path)
+    # blobs are named after their content, so files sharing a basename never
+    # overwrite each other, even when uploaded concurrently
+    name = config.BUCKET_PREFIX + "/" + _md5(path) + "/" + filename
+    key = (config.BUCKET_NAME, name)
+    with _uploads_lock:
+        cached = _uploads.get(key)
+        if cached is not None:
+            url, expire_in = cached
+            if expire_in - datetime.today() > UPLOAD_URL_MARGIN:
+                _uploads.move_to_end(key)
+                return url
+
+    expire_in = datetime.today() + timedelta(hours=1)
+    # use google cloud storage client
+    bucket = config.BUCKET_HANDLE
+    blob = bucket.get_blob(name)
+    # an existing blob already holds exactly this content
+    if blob is None:
+        blob = bucket.blob(name, chunk_size=UPLOAD_CHUNK_SIZE)
+        blob.upload_from_filename(path)
+    url = blob.generate_signed_url(expire_in)
+
+    with _uploads_lock:
+        _uploads[key] = (url, expire_in)
+        _uploads.move_to_end(key)
+        if len(_uploads) > UPLOAD_CACHE_SIZE:
+            _uploads.popitem(last=False)
+    return url
 
 
 class Image:
+    __slots__ = ("obj_id", "doc_id", "src", "transform", "size")
+
     def __init__(self,
                  obj_id: str,
                  doc_id: str,
@@ -146,37 +289,31 @@ class Image:
 
     def replace_image(self, value):
         if value[:4] == "http":
-            self.url = value
+            self.set_url(value)
         else:
-            self.file = value
-
-    def __setattr__(self, name: str, value: str):
-        if name == "url":
-            requests = [
-                {
-                    'replaceImage': {
-                        'imageObjectId': self.obj_id,
-                        'imageReplaceMethod': 'CENTER_INSIDE',
-                        'url': value
-                    }
+            self.set_file(value)
+
+    def _url_requests(self, url: str) -> list:
+        return [
+            {
+                'replaceImage': {
+                    'imageObjectId': self.obj_id,
+                    'imageReplaceMethod': 'CENTER_INSIDE',
+                    'url': url
                 }
-            ]
-            config.SLIDES.presentations().batchUpdate(
-                body={"requests": requests},
-                presentationId=self.doc_id).execute()
-
-        elif name == "file":
-            filename = value.split("/")[-1]
-            expire_in = datetime.today() + timedelta(hours=1)
-            # use google cloud storage client
-            bucket = config.BUCKET.removeprefix("gs://").split("/")[0]
-            blob = "/".join(config.BUCKET.removeprefix("gs://").split("/")[1:])
-            blob = config.STORAGE_CLIENT.bucket(bucket).blob(blob+"/"+filename)
-            blob.upload_from_filename(value)
-            url = blob.generate_signed_url(expire_in)
-            self.url = url
-        else:
-            super(Image, self).__setattr__(name, value)
+            }
+        ]
+
+    def set_url(self, url: str):
+        _submit(self.doc_id, self._url_requests(url))
+
+    def set_file(self, path: str):
+        # inside batch() the upload runs concurrently with the other ones
+        submit_deferred(self.doc_id, _upload, path, self._url_requests)
+
+    # write-only aliases kept for `image.url = ...` / `image.file = ...`
+    url = property(None, set_url)
+    file = property(None, set_file)
 
     def __repr__(self) -> str:
         return f"<{self.src}>"
@@ -189,18 +326,28 @@ class Image:
 class Charts:
     def __init__(self):
         self.elements = []
+        self.by_id = {}
 
     def add(self, chart: "Chart"):
         self.elements.append(chart)
+        self.by_id[chart.obj_id] = chart
 
-    def __setitem__(self, key: int, value: str):
-        self.elements[key].replace_chart(value)
-
-    def __getitem__(self, key):
+    def _get(self, key: Union[int, str]) -> "Chart":
+        # charts are addressed by position or by object id
+        if isinstance(key, str):
+            return self.by_id[key]
         return self.elements[key]
 
+    def __setitem__(self, key: Union[int, str], value: "SheetChart"):
+        self._get(key).replace_chart(value)
+
+    def __getitem__(self, key: Union[int, str]) -> "Chart":
+        return self._get(key)
+
 
 class Chart:
+    __slots__ = ("obj_id", "slide_id", "doc_id", "size", "transform")
+
     def __init__(self,
                  obj_id: str,
                  doc_id: str,
@@ -213,7 +360,9 @@ class Chart:
         self.size = size
         self.transform = transform
 
-    def replace_chart(self, sheet_chart: "SheetChart"):
+    def replace_chart(self,
+                      sheet_chart: "SheetChart",
+                      eager_refresh: bool = False):
         ss_id = sheet_chart.spreadsheet_id
         chart_id = sheet_chart.chart_id
         requests = [
@@ -234,16 +383,16 @@ class Chart:
                         "pageObjectId": self.slide_id
                     }
                 }
-            },
-            {
+            }
+        ]
+        # a freshly created chart already reflects the current sheet data
+        if eager_refresh:
+            requests.append({
                 'refreshSheetsChart': {
                     'objectId': self.obj_id
                 }
-            }
-        ]
-        config.SLIDES.presentations().batchUpdate(
-            body={"requests": requests},
-            presentationId=self.doc_id).execute()
+            })
+        _submit(self.doc_id, requests)
 
     def __repr__(self) -> str:
         return f"{self.obj_id}"
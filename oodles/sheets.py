@@ -1,13 +1,53 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-from typing import Union
+import threading
+from collections import OrderedDict
+from typing import List, Union
 
 from googleapiclient.errors import HttpError
 
 from .element import SheetChart
-from .utils import hex_to_rgb, GoogleAuthorizationError
+from .utils import (
+    hex_to_rgb, hex_to_rgb_batch, execute_batch, share_file,
+    GoogleAuthorizationError,
+)
 from .config import config
 
+# parts of the spreadsheet read by Sheet.load()
+SHEET_LOAD_FIELDS = "sheets(properties,charts/chartId)"
+# parts of each spreadsheet read by Sheets.load_many()
+LOAD_MANY_FIELDS = "properties," + SHEET_LOAD_FIELDS
+
+# cell values read recently: (doc_id, range) -> (Drive version, values)
+_values = OrderedDict()
+_values_lock = threading.Lock()
+VALUES_CACHE_SIZE = 64
+
+
+def _evict_values(doc_id: str):
+    """Forget the cached values of a spreadsheet after writing to it."""
+    with _values_lock:
+        for key in [key for key in _values if key[0] == doc_id]:
+            del _values[key]
+
+
+def _file_version(doc_id: str) -> str:
+    """Drive version of a file, bumped by every change made to it."""
+    return (
+        config.DRIVE.files()
+        .get(fileId=doc_id, fields="version")
+        .execute()["version"]
+    )
+
+
+def _to_frame(values: list):
+    """DataFrame from rows of cell values, the first one being the header."""
+    import pandas as pd
+
+    if not values:
+        return pd.DataFrame()
+    return pd.DataFrame.from_records(values[1:], columns=values[0])
+
 
 class Sheets:
     def __init__(self, doc_id: str):
@@ -34,26 +74,48 @@ class Sheets:
         )
         return Sheets(new_id)
 
-    def share_with(self, email: str, as_admin: bool = False):
-        user_permission = {
-            "type": "user",
-            "role": "owner" if as_admin else "writer",
-            "emailAddress": email,
-        }
-        config.DRIVE.permissions().create(
-            fileId=self.doc_id,
-            body=user_permission,
-            fields="id",
-            transferOwnership=as_admin,
-        ).execute()
+    def share_with(self,
+                   email: Union[str, List[str]],
+                   as_admin: bool = False,
+                   send_notification_email: bool = True):
+        share_file(self.doc_id, email, as_admin, send_notification_email)
 
     def load(self):
         try:
             sheet = config.SHEETS.spreadsheets()
             result = sheet.get(spreadsheetId=self.doc_id).execute()
-            self.document = result
         except HttpError as e:
             raise GoogleAuthorizationError(e, config.service_email)
+        self._set_document(result)
+
+    @classmethod
+    def load_many(cls, doc_ids: List[str]) -> List["Sheets"]:
+        """Load several spreadsheets with one batch request.
+
+        Only the spreadsheet properties and the sheet properties and chart
+        ids are fetched, which is all Sheets and Sheet rely on.
+        """
+        requests = [
+            config.SHEETS.spreadsheets().get(
+                spreadsheetId=doc_id, fields=LOAD_MANY_FIELDS)
+            for doc_id in doc_ids
+        ]
+        try:
+            documents = execute_batch(config.SHEETS, requests)
+        except HttpError as e:
+            raise GoogleAuthorizationError(e, config.service_email)
+        spreadsheets = []
+        for doc_id, document in zip(doc_ids, documents):
+            # skip __init__, which would fetch the spreadsheet again
+            sheets = cls.__new__(cls)
+            sheets.doc_id = doc_id
+            sheets.url = "https://docs.google.com/spreadsheets/d/" + doc_id
+            sheets._set_document(document)
+            spreadsheets.append(sheets)
+        return spreadsheets
+
+    def _set_document(self, document: dict):
+        self.document = document
         self.sheets = self.document.get("sheets")
         self.title = self.document["properties"]["title"]
 
@@ -84,22 +146,50 @@ class Sheets:
                     }
                 }
             ]
-            config.SHEETS.spreadsheets().batchUpdate(
-                spreadsheetId=self.doc_id, body={"requests": requests}
+            response = config.SHEETS.spreadsheets().batchUpdate(
+                spreadsheetId=self.doc_id,
+                body={
+                    "requests": requests,
+                    "includeSpreadsheetInResponse": True,
+                    "responseIncludeGridData": False,
+                },
             ).execute()
-            self.load()
+            self._set_document(response["updatedSpreadsheet"])
             sheet = self.__getitem__(name)
+        else:
+            # a freshly added sheet is already empty
+            sheet.clear()
 
-        sheet.clear()
         sheet.value = df
 
+    def batch_values(self, ranges: List[str]) -> dict:
+        """Read several A1 ranges in one request, as {range: DataFrame}."""
+        result = (
+            config.SHEETS.spreadsheets()
+            .values()
+            .batchGet(spreadsheetId=self.doc_id, ranges=ranges,
+                      majorDimension="ROWS")
+            .execute()
+        )
+        # value ranges come back in the order they were asked for
+        return {
+            range_: _to_frame(value_range.get("values", []))
+            for range_, value_range in zip(ranges, result.get("valueRanges", []))
+        }
+
     def __delitem__(self, name: str):
         sheet = self.__getitem__(name)
         requests = [{"deleteSheet": {"sheetId": sheet.sheet_id}}]
-        config.SHEETS.spreadsheets().batchUpdate(
-            spreadsheetId=self.doc_id, body={"requests": requests}
+        response = config.SHEETS.spreadsheets().batchUpdate(
+            spreadsheetId=self.doc_id,
+            body={
+                "requests": requests,
+                "includeSpreadsheetInResponse": True,
+                "responseIncludeGridData": False,
+            },
         ).execute()
-        self.load()
+        _evict_values(self.doc_id)
+        self._set_document(response["updatedSpreadsheet"])
 
 
 class Sheet:
@@ -112,11 +202,17 @@ class Sheet:
         self.parse()
 
     def load(self):
-        sheets = Sheets(self.doc_id)
-        sheet = sheets[self.title]
-        self.content = sheet.content
-        self.title = sheet.title
-        self.sheet_id = sheet.sheet_id
+        # only the sheet properties and chart ids are needed here
+        result = config.SHEETS.spreadsheets().get(
+            spreadsheetId=self.doc_id, fields=SHEET_LOAD_FIELDS
+        ).execute()
+        for content in result.get("sheets", []):
+            if content["properties"]["sheetId"] == self.sheet_id:
+                break
+        else:
+            raise NameError(f"Sheet '{self.title}' not found")
+        self.content = content
+        self.title = content["properties"]["title"]
         self.parse()
 
     def clear(self):
@@ -131,75 +227,132 @@ class Sheet:
         config.SHEETS.spreadsheets().batchUpdate(
             spreadsheetId=self.doc_id, body={"requests": requests}
         ).execute()
+        _evict_values(self.doc_id)
 
     def parse(self):
+        # keep the SheetChart objects of charts that are still there
+        previous = {chart.chart_id: chart for chart in getattr(self, "chart", [])}
         charts = []
         for obj in self.content.get("charts", []):
             spreadsheet_id = self.doc_id
             chart_id = obj["chartId"]
-            charts.append(SheetChart(spreadsheet_id, chart_id))
+            chart = previous.get(chart_id)
+            if chart is None:
+                chart = SheetChart(spreadsheet_id, chart_id)
+            charts.append(chart)
         self.chart = charts
 
     def __setattr__(self, name: str, value):
         if name == "value":
-            data = []
-            for col in value.columns:
-                # datetime64
-                if value[col].dtype == "datetime64[ns]":
-                    items = [col] + value[col].apply(
-                        lambda x: x.strftime("%Y-%m-%d %H:%M:%S")
-                    ).tolist()
-                    data.append(items)
-                else:
-                    data.append([col] + value[col].tolist())
-            resource = {"majorDimension": "COLUMNS", "values": data}
-
-            data_range = f"{self.title}!A:A"
-            config.SHEETS.spreadsheets().values().append(
-                spreadsheetId=self.doc_id,
-                range=data_range,
-                body=resource,
-                valueInputOption="USER_ENTERED",
-            ).execute()
+            self.set_value(value)
         else:
             super(Sheet, self).__setattr__(name, value)
 
-    def values(self, _range=""):
-        import pandas as pd
+    def set_value(self, value, value_input_option: str = None):
+        """Write a dataframe, with its header, from the top-left cell.
 
-        if len(_range) > 0:
-            sheet_title = f"{self.title}!{_range}"
+        value_input_option defaults to RAW for purely numeric or boolean
+        frames, which skips Google's parsing, and USER_ENTERED otherwise.
+        """
+        df = value
+        dt_cols = value.select_dtypes(include=["datetime64[ns]"]).columns
+        if len(dt_cols):
+            df = value.copy()
+            for col in dt_cols:
+                df[col] = value[col].dt.strftime("%Y-%m-%d %H:%M:%S")
+        if value_input_option is None:
+            literal = len(value.select_dtypes(include=["number", "bool"]).columns)
+            value_input_option = (
+                "RAW" if literal == len(value.columns) else "USER_ENTERED"
+            )
+        # python scalars for JSON, missing values as empty cells
+        body = df.astype(object).where(df.notna(), None).values.tolist()
+        data = [value.columns.tolist()] + body
+        resource = {"majorDimension": "ROWS", "values": data}
+
+        # the position is known: update avoids append's scan for a free row
+        config.SHEETS.spreadsheets().values().update(
+            spreadsheetId=self.doc_id,
+            range=f"{self.title}!A1",
+            body=resource,
+            valueInputOption=value_input_option,
+        ).execute()
+        _evict_values(self.doc_id)
+
+    def _fetch_raw(self, range_: str = "", cached: bool = True) -> list:
+        """Cell values of the sheet, or of a range of it, as a list of rows."""
+        if len(range_) > 0:
+            sheet_title = f"{self.title}!{range_}"
         else:
             sheet_title = self.title
-        request = (
+        key = (self.doc_id, sheet_title)
+        version = None
+        if cached:
+            with _values_lock:
+                entry = _values.get(key)
+            # cold reads skip the version check: the values are stored
+            # unversioned and only re-read once the range is read again
+            if entry is not None:
+                # a version check is far smaller than the values themselves
+                version = _file_version(self.doc_id)
+                if entry[0] == version:
+                    with _values_lock:
+                        if key in _values:
+                            _values.move_to_end(key)
+                    return entry[1]
+        values = (
             config.SHEETS.spreadsheets()
             .values()
             .get(spreadsheetId=self.doc_id, range=sheet_title)
+            .execute()
+            .get("values", [])
         )
-        values = request.execute()["values"]
-        df = pd.DataFrame(values[1:], columns=values[0])
-        return df
+        if cached:
+            with _values_lock:
+                _values[key] = (version, values)
+                _values.move_to_end(key)
+                if len(_values) > VALUES_CACHE_SIZE:
+                    _values.popitem(last=False)
+        return values
+
+    def values(self, _range: Union[str, List[str]] = ""):
+        """Values as a DataFrame, or a dict of them for a list of ranges."""
+        if isinstance(_range, list):
+            # one batchGet for every range
+            ranges = [f"{self.title}!{r}" if r else self.title for r in _range]
+            frames = self.parent.batch_values(ranges)
+            return {r: frames[full] for r, full in zip(_range, ranges)}
+        return _to_frame(self._fetch_raw(_range))
 
-    def create_serie(self, col_id, size, colors=None, i=0, chart_type="COLUMN"):
+    def _get_header(self) -> list:
+        """Fetch only the header row."""
+        # a single row costs no more than the version check of the cache
+        return (self._fetch_raw("1:1", cached=False) or [[]])[0]
+
+    def _column_range(self, col_id: int, size: int = None) -> dict:
+        """GridRange of a column, down to the last row unless size is given."""
+        grid_range = {
+            "sheetId": self.sheet_id,
+            "startRowIndex": 0,
+            "startColumnIndex": col_id,
+            "endColumnIndex": col_id + 1,
+        }
+        if size is not None:
+            grid_range["endRowIndex"] = size + 1
+        return grid_range
+
+    def create_serie(self, col_id, size=None, rgb=None, chart_type="COLUMN"):
         serie = {
             "series": {
                 "sourceRange": {
-                    "sources": [
-                        {
-                            "sheetId": self.sheet_id,
-                            "startRowIndex": 0,
-                            "endRowIndex": size + 1,
-                            "startColumnIndex": col_id,
-                            "endColumnIndex": col_id + 1,
-                        }
-                    ]
+                    "sources": [self._column_range(col_id, size)]
                 }
             },
             "targetAxis": "BOTTOM_AXIS" if chart_type == "BAR" else "LEFT_AXIS",
         }
-        if colors is not None:
-            r, g, b = hex_to_rgb(colors[i])
-            serie["color"] = {"red": r / 255, "green": g / 255, "blue": b / 255}
+        if rgb is not None:
+            r, g, b = rgb
+            serie["color"] = {"red": r, "green": g, "blue": b}
         return serie
 
     def create_chart(
@@ -214,27 +367,87 @@ class Sheet:
             legend_position="TOP_LEGEND",
             smooth=False
     ):
+        self.create_charts([{
+            "x": x,
+            "y": y,
+            "colors": colors,
+            "label_color": label_color,
+            "background_color": background_color,
+            "chart_type": chart_type,
+            "stacked_type": stacked_type,
+            "legend_position": legend_position,
+            "smooth": smooth,
+        }])
+
+    def create_charts(self, chart_specs: List[dict]):
+        """Create several charts in one batchUpdate.
+
+        Each spec holds the keyword arguments of create_chart.
+        """
+        # get the header once for all charts; the ranges are open-ended, so
+        # the number of data rows is not needed
+        cols = self._get_header()
+        col_ids = {col: i for i, col in enumerate(cols)}
+        requests = [
+            self._build_chart_request(col_ids, **spec)
+            for spec in chart_specs
+        ]
+
+        # Execute request, getting the updated spreadsheet back in the reply
+        response = config.SHEETS.spreadsheets().batchUpdate(
+            spreadsheetId=self.doc_id,
+            body={
+                "requests": requests,
+                "includeSpreadsheetInResponse": True,
+                "responseIncludeGridData": False,
+            },
+        ).execute()
+        _evict_values(self.doc_id)
+        self.parent._set_document(response["updatedSpreadsheet"])
+
+    def _build_chart_request(
+            self,
+            col_ids,
+            x,
+            y,
+            colors=None,
+            label_color="#000000",
+            background_color="#FFFFFF",
+            chart_type="COLUMN",
+            stacked_type="NOT_STACKED",
+            legend_position="TOP_LEGEND",
+            smooth=False
+    ) -> dict:
         if legend_position is None:
             legend_position = "NO_LEGEND"
-        # get values
-        df = self.values()
-        size = df.shape[0]
+
+        # check every column before building anything
+        names = [x] + (y if isinstance(y, list) else [y])
+        missing = [name for name in names if name not in col_ids]
+        if missing:
+            raise ValueError(
+                f"Columns {missing} not found in sheet '{self.title}'")
 
         # create serie
         series = []
-        cols = list(df.columns)
 
         # define x axis
-        index_id = cols.index(x)
+        index_id = col_ids[x]
+
+        # parse the palette once, as 0-1 floats
+        rgb_list = [None] * (len(y) if isinstance(y, list) else 1)
+        if colors is not None:
+            rgb_list = hex_to_rgb_batch(colors)
 
         # define y axis
         if isinstance(y, list):
             for i, y_ in enumerate(y):
-                col_id = cols.index(y_)
-                series.append(self.create_serie(col_id, size, colors, i))
+                col_id = col_ids[y_]
+                series.append(self.create_serie(col_id, None, rgb_list[i]))
         else:
-            col_id = cols.index(y)
-            series.append(self.create_serie(col_id, size, colors, 0, chart_type))
+            col_id = col_ids[y]
+            series.append(
+                self.create_serie(col_id, None, rgb_list[0], chart_type))
 
         # create background color
         r, g, b = hex_to_rgb(background_color)
@@ -255,62 +468,47 @@ class Sheet:
             {
                 "domain": {
                     "sourceRange": {
-                        "sources": [
-                            {
-                                "sheetId": self.sheet_id,
-                                "startRowIndex": 0,
-                                "endRowIndex": size + 1,
-                                "startColumnIndex": index_id,
-                                "endColumnIndex": index_id + 1,
-                            }
-                        ]
+                        "sources": [self._column_range(index_id)]
                     }
                 }
             }
         ]
-        requests = [
-            {
-                "addChart": {
-                    "chart": {
-                        "spec": {
-                            "backgroundColor": background_color,
-                            "title": "",
-                            "titleTextFormat": text_format,
-                            "basicChart": {
-                                "chartType": chart_type,
-                                "legendPosition": legend_position,
-                                "domains": domains,
-                                "series": series,
-                                "headerCount": 1,
-                                "stackedType": (
-                                    stacked_type if chart_type == "BAR" else None
-                                ),
-                            },
-                        },
-                        "position": {
-                            "overlayPosition": {
-                                "anchorCell": {
-                                    "sheetId": self.sheet_id,
-                                    "rowIndex": 0,
-                                    "columnIndex": 0,
-                                },
-                                "offsetXPixels": 500,
-                                "offsetYPixels": 100,
-                            }
+        request = {
+            "addChart": {
+                "chart": {
+                    "spec": {
+                        "backgroundColor": background_color,
+                        "title": "",
+                        "titleTextFormat": text_format,
+                        "basicChart": {
+                            "chartType": chart_type,
+                            "legendPosition": legend_position,
+                            "domains": domains,
+                            "series": series,
+                            "headerCount": 1,
+                            "stackedType": (
+                                stacked_type if chart_type == "BAR" else None
+                            ),
                         },
-                    }
+                    },
+                    "position": {
+                        "overlayPosition": {
+                            "anchorCell": {
+                                "sheetId": self.sheet_id,
+                                "rowIndex": 0,
+                                "columnIndex": 0,
+                            },
+                            "offsetXPixels": 500,
+                            "offsetYPixels": 100,
+                        }
+                    },
                 }
             }
-        ]
+        }
 
         # Additional graph options
         if chart_type == "LINE":
-            requests[0]["addChart"]["chart"]["spec"]["basicChart"].update({
+            request["addChart"]["chart"]["spec"]["basicChart"].update({
                 "lineSmoothing": smooth
             })
-
-        # Execute request
-        config.SHEETS.spreadsheets().batchUpdate(
-            spreadsheetId=self.doc_id, body={"requests": requests}
-        ).execute()
-        self.parent.load()
+        return request
@@ -1,13 +1,27 @@
 import os.path
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
+from typing import List, Union
 
-import addict
-import requests
-from google.auth.transport.requests import AuthorizedSession
 from googleapiclient.errors import HttpError
 
 from .element import Chart, Charts, Image, Images, TextBlock, TextBlocks
 from .config import config
-from .utils import GoogleAuthorizationError
+from .utils import GoogleAuthorizationError, share_file
+
+# screenshots taken at the same time by Slides.screenshot_all()
+SCREENSHOT_WORKERS = 4
+# thumbnails are written to disk in chunks of this size
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# parts of the presentation read when a Slides object is created
+LOAD_FIELDS = "title"
+# parts of the slides read by Slide.parse(), fetched on first access
+PAGES_FIELDS = (
+    "slides(objectId,pageElements(objectId,transform,size,"
+    "shape(text(textElements(textRun(content,style)))),"
+    "image(contentUrl),sheetsChart(spreadsheetId,chartId)))"
+)
 
 
 class Slides:
@@ -15,28 +29,56 @@ class Slides:
         self.doc_id = doc_id
         try:
             self.document = (
-                config.SLIDES.presentations().get(presentationId=doc_id).execute()
+                config.SLIDES.presentations()
+                .get(presentationId=doc_id, fields=LOAD_FIELDS)
+                .execute()
             )
         except HttpError as e:
             raise GoogleAuthorizationError(e, config.service_email)
-        self.pages = self.document.get("slides")
         self.title = self.document["title"]
         self.url = "https://docs.google.com/presentation/d/" + self.doc_id
 
+    @classmethod
+    def _from_document(cls, doc_id: str, document: dict) -> "Slides":
+        """Slides built from an already known document, without a fetch."""
+        slides = cls.__new__(cls)
+        slides.doc_id = doc_id
+        slides.document = document
+        slides.title = document["title"]
+        slides.url = "https://docs.google.com/presentation/d/" + doc_id
+        return slides
+
+    @cached_property
+    def pages(self) -> list:
+        # copy, share_with and title never need the slide contents
+        try:
+            result = (
+                config.SLIDES.presentations()
+                .get(presentationId=self.doc_id, fields=PAGES_FIELDS)
+                .execute()
+            )
+        except HttpError as e:
+            raise GoogleAuthorizationError(e, config.service_email)
+        self.document["slides"] = result.get("slides", [])
+        return self.document["slides"]
+
     def copy(self, title: str = None):
         if title is None:
             title = f"Copy of {self.title}"
         data = {"name": title}
-        new_id = (
-            config.DRIVE.files().copy(body=data, fileId=self.doc_id).execute().get("id")
+        copied = (
+            config.DRIVE.files()
+            .copy(body=data, fileId=self.doc_id, fields="id,name")
+            .execute()
         )
-        return Slides(new_id)
+        # the copy's title is known; its pages are fetched on first access
+        return Slides._from_document(copied["id"], {"title": copied["name"]})
 
-    def share_with(self, email: str):
-        user_permission = {"type": "user", "role": "writer", "emailAddress": email}
-        config.DRIVE.permissions().create(
-            fileId=self.doc_id, body=user_permission, fields="id"
-        ).execute()
+    def share_with(self,
+                   email: Union[str, List[str]],
+                   as_admin: bool = False,
+                   send_notification_email: bool = True):
+        share_file(self.doc_id, email, as_admin, send_notification_email)
 
     def __getitem__(self, page: int) -> "Slide":
         if page == 0:
@@ -53,29 +95,54 @@ class Slides:
         """
         self[slide_num].screenshot(path)
 
+    def screenshot_all(self,
+                       paths: Union[str, dict],
+                       max_workers: int = SCREENSHOT_WORKERS):
+        """
+        Takes screenshots of several slides concurrently.
+        :param paths: A folder where every slide is saved as slide_<n>.png,
+            or a dict mapping slide numbers (starting at 1) to paths
+        :param max_workers: Number of slides fetched at the same time
+        """
+        # fetch the pages once, before the workers would race to do it on
+        # the shared, non thread-safe transport
+        pages = self.pages
+        if isinstance(paths, str):
+            if paths.endswith(".png"):
+                raise ValueError(
+                    "screenshot_all expects a folder or a dict of paths, "
+                    "not a single PNG file."
+                )
+            paths = {num: paths for num in range(1, len(pages) + 1)}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(
+                lambda item: self.screenshot(*item), paths.items()))
+
 
 class Slide:
     def __init__(self, doc_id: str, page: int, content: dict):
         self.doc_id = doc_id
         self.page = page
-        self.content = addict.Dict(content)
-        self.slide_id = self.content.objectId
+        self.content = content
+        self.slide_id = content["objectId"]
         self.parse()
 
     def parse(self):
         texts = []
         imgs = Images()
         charts = Charts()
-        for obj in self.content.pageElements:
+        for obj in self.content.get("pageElements", []):
             obj_id = obj["objectId"]
-            if "shape" in obj and "text" in obj.shape:
+            if "shape" in obj and "text" in obj["shape"]:
                 text = obj["shape"]["text"]["textElements"]
                 for item in text:
                     if "textRun" in item:
                         style = item["textRun"]["style"]
                         content = item["textRun"]["content"].strip()
                         if len(content) > 1:
-                            texts.append(TextBlock(obj_id, content, style))
+                            texts.append(TextBlock(
+                                obj_id, content, style,
+                                self.slide_id, self.doc_id))
             elif "image" in obj:
                 transform = obj["transform"]
                 size = obj["size"]
@@ -124,9 +191,8 @@ class Slide:
                 )
             path = os.path.join(path, f"slide_{self.page}.png")
 
-        http = config.SLIDES._http
-        credentials = http.credentials
-        authed_session = AuthorizedSession(credentials)
+        # pooled sessions, so consecutive screenshots reuse connections
+        authed_session = config.AUTHED_SESSION
 
         url = f"https://slides.googleapis.com/v1/presentations/{self.doc_id}/pages/{self.slide_id}/thumbnail"
         params = {
@@ -141,14 +207,16 @@ class Slide:
             if not thumbnail_url:
                 raise Exception("Thumbnail URL not found in the response.")
 
-            image_response = requests.get(thumbnail_url)
-            if image_response.status_code == 200:
-                with open(path, "wb") as f:
-                    f.write(image_response.content)
-            else:
-                raise Exception(
-                    f"Failed to download thumbnail image. Status code: {image_response.status_code}"
-                )
+            # stream the image to disk instead of buffering it whole
+            with config.HTTP_SESSION.get(thumbnail_url, stream=True) as image_response:
+                if image_response.status_code == 200:
+                    with open(path, "wb") as f:
+                        for chunk in image_response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                            f.write(chunk)
+                else:
+                    raise Exception(
+                        f"Failed to download thumbnail image. Status code: {image_response.status_code}"
+                    )
         else:
             raise Exception(
                 f"Failed to get thumbnail. Status code: {response.status_code}, Response: {response.text}"
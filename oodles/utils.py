@@ -1,15 +1,144 @@
+import random
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import List, Union
+
 from googleapiclient.errors import HttpError
 
+from .config import NUM_RETRIES, config
+
+_HEX_COLOR_RE = re.compile(r"[0-9a-fA-F]{6}")
+
+# batch requests sent concurrently when a flush spans several of them
+MAX_WORKERS = 8
+
+# batch parts failing with these statuses are sent again
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+# seconds, doubled on each attempt
+RETRY_BASE_DELAY = 0.5
+
+# long-lived workers, so their keep-alive connections survive between flushes
+_executor = None
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+    return _executor
+
+
+@lru_cache(maxsize=256)
 def hex_to_rgb(h):
     if h is None:
         return None
     elif isinstance(h, tuple):
         return h
     else:
-        h = h.lstrip("#")
-        if len(h) == 3:
-            h += h
-        return tuple(int(h[i:i + 2], 16) for i in (0, 2, 4))
+        digits = h.lstrip("#")
+        if len(digits) == 3:
+            digits = "".join(c * 2 for c in digits)
+        # bytes.fromhex alone would accept spaces and odd lengths
+        if not _HEX_COLOR_RE.fullmatch(digits):
+            raise ValueError(f"Invalid hex color: {h!r}")
+        return tuple(bytes.fromhex(digits))
+
+
+def hex_to_rgb_batch(colors: list) -> list:
+    """(r, g, b) floats between 0 and 1 for each color of a palette."""
+    return [tuple(v / 255 for v in hex_to_rgb(color)) for color in colors]
+
+
+def chunks(items: list, size: int):
+    """Yield successive slices of at most size items."""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def execute_batch(service,
+                  requests: list,
+                  batch_size: int = 100,
+                  max_workers: int = MAX_WORKERS):
+    """Send requests as multipart batches, raising the first failure.
+
+    Parts failing with 429 or 5xx are sent again with exponential backoff,
+    as RetryHttpRequest does for single requests. Returns the responses in
+    the order of the requests.
+    """
+    responses = [None] * len(requests)
+    pending = list(enumerate(requests))
+    for attempt in range(NUM_RETRIES + 1):
+        errors = []
+        retry = []
+
+        def callback(request_id, response, exception):
+            if exception is None:
+                responses[pending[int(request_id)][0]] = response
+                return
+            status = getattr(getattr(exception, "resp", None), "status", None)
+            if (attempt < NUM_RETRIES and isinstance(exception, HttpError)
+                    and status in RETRY_STATUSES):
+                retry.append(pending[int(request_id)])
+            else:
+                errors.append(exception)
+
+        batches = []
+        for start in range(0, len(pending), batch_size):
+            batch = service.new_batch_http_request(callback=callback)
+            for i in range(start, min(start + batch_size, len(pending))):
+                batch.add(pending[i][1], request_id=str(i))
+            batches.append(batch)
+
+        if not hasattr(config, "_credentials"):
+            # injected clients: no credentials to give other threads a transport
+            for batch in batches:
+                batch.execute()
+        elif len(batches) > 1 and max_workers > 1:
+            # httplib2 is not thread-safe: each worker uses its own transport
+            for i in range(0, len(batches), max_workers):
+                list(get_executor().map(
+                    lambda batch: batch.execute(http=config.thread_http()),
+                    batches[i:i + max_workers]))
+        else:
+            for batch in batches:
+                batch.execute(http=config.thread_http())
+        if errors:
+            raise errors[0]
+        if not retry:
+            return responses
+        # full jitter, so concurrent callers do not retry in lockstep
+        time.sleep(random.uniform(0, RETRY_BASE_DELAY * 2 ** attempt))
+        pending = retry
+
+
+def share_file(file_id: str,
+               email: Union[str, List[str]],
+               as_admin: bool = False,
+               send_notification_email: bool = True):
+    """Give one or several users access to a Drive file.
+
+    Drive does not support concurrent permission changes on the same file,
+    so the permissions are created one after the other, never batched.
+    as_admin transfers the ownership, hence takes a single email.
+    """
+    if as_admin and not isinstance(email, str):
+        raise ValueError("A file has a single owner: as_admin takes one email")
+    emails = [email] if isinstance(email, str) else email
+    for email in emails:
+        config.DRIVE.permissions().create(
+            fileId=file_id,
+            body={
+                "type": "user",
+                "role": "owner" if as_admin else "writer",
+                "emailAddress": email,
+            },
+            fields="id",
+            transferOwnership=as_admin,
+            sendNotificationEmail=send_notification_email,
+        ).execute()
+
 
 class GoogleAuthorizationError(HttpError):
     def __init__(self,error: HttpError,  email: str, *args: object) -> None:
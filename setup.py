@@ -10,7 +10,14 @@ setuptools.setup(
     url="https://github.com/kerighan/oodles",
     packages=setuptools.find_packages(),
     include_package_data=True,
-    install_requires=["addict==2.4.0", "google-api-python-client", "google-auth"],
+    install_requires=[
+        "google-api-python-client>=2.0",
+        "google-auth",
+        "google-auth-httplib2",
+        "httplib2",
+        "requests",
+    ],
+    extras_require={"fast": ["orjson"]},
     classifiers=[
         "Programming Language :: Python :: 3",
         "Programming Language :: Python :: 3.7",